@@ -5,45 +5,107 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+from redis.asyncio import Redis
 from datetime import datetime, timezone
+from functools import lru_cache
 import os
 from dotenv import load_dotenv
-from typing import Union
-from pydantic import BaseModel
+from typing import List, Optional, Union
+from pydantic import BaseModel, TypeAdapter
 
 # Load environment variables from .env file
 load_dotenv()
 
 _client = None
 db = None
+cache = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
+redis_url = os.getenv("REDIS_URL")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # One pooled client per process; handlers borrow sockets instead of reconnecting.
+    # Pool sizes apply per worker, so size them against the server's connection limit.
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "1")),
+        maxIdleTimeMS=60000,
+        retryWrites=True,
+        w="majority",
+    )
     db = _client[database_name]
 
+# Optional read-through cache for hot browse endpoints; disabled when REDIS_URL is unset
+if redis_url:
+    # short timeouts so an unresponsive Redis falls back to MongoDB instead of stalling requests
+    cache = Redis.from_url(redis_url, socket_connect_timeout=0.2, socket_timeout=0.2)
+
+async def close_connections():
+    """Close the shared MongoDB and Redis clients (call once on shutdown)"""
+    if _client is not None:
+        _client.close()
+    if cache is not None:
+        await cache.aclose()
+
+@lru_cache(maxsize=None)
+def _list_dumper(model_cls):
+    """Compiled serializer turning a list of model_cls instances into dicts in one call"""
+    return TypeAdapter(List[model_cls]).dump_python
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
-    # Convert Pydantic model to dict if needed
+    # Convert Pydantic model to dict if needed; JSON mode stores dates as ISO strings,
+    # since BSON cannot encode datetime.date
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
+        data_dict = data.model_dump(mode="json")
     else:
         data_dict = data.copy()
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]) -> List[Optional[str]]:
+    """Insert many documents with timestamps in a single round-trip.
+
+    Returns ids aligned with items, with None for documents that failed to insert.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    model_cls = type(items[0]) if items else None
+    if model_cls is not None and issubclass(model_cls, BaseModel) and all(type(i) is model_cls for i in items):
+        # homogeneous batch: serialize the whole list through the cached pydantic-core serializer
+        docs = _list_dumper(model_cls)(items, mode="json")
+    else:
+        docs = [data.model_dump(mode="json") if isinstance(data, BaseModel) else data.copy() for data in items]
+    for data_dict in docs:
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+
+    # unordered so one failing document does not stop the rest of the batch
+    try:
+        await db[collection_name].insert_many(docs, ordered=False)
+    except BulkWriteError as exc:
+        if exc.details.get("writeConcernErrors"):
+            raise
+        # the rest of the batch was written; insert_many assigned each doc its _id
+        failed = {err["index"] for err in exc.details.get("writeErrors", [])}
+        return [None if n in failed else str(d["_id"]) for n, d in enumerate(docs)]
+    return [str(d["_id"]) for d in docs]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +114,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit)
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings for production
+
+Run with: gunicorn main:app -c gunicorn_conf.py
+Each worker is a UvicornWorker with its own event loop (uvloop + httptools
+via uvicorn[standard]), so all cores serve requests.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 5
+accesslog = "-"
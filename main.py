@@ -1,47 +1,269 @@
+import asyncio
+import hashlib
+import logging
 import os
-from typing import Optional
+from datetime import datetime, time, timezone
+from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException
+import orjson
+from fastapi import Body, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-from database import db, create_document, get_documents
+from database import db, cache, close_connections, create_document, create_documents
 from schemas import User, Car, Listing, Booking, Review
 
-app = FastAPI(title="RAKB API", description="Rental Agency platform for cars and renters in Morocco")
+logger = logging.getLogger(__name__)
+
+
+def dump_json(content) -> bytes:
+    """Serialize with orjson, rendering BSON types (e.g. ObjectId) as strings"""
+    return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSON response that also serializes BSON types (e.g. ObjectId) as strings"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+
+# Case-insensitive (strength 2) collation shared by the city index and browse queries
+CITY_COLLATION = {"locale": "en", "strength": 2}
+
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+# Redis keys and TTL for cached browse responses
+CITIES_CACHE_KEY = "cities:v1"
+LISTINGS_CACHE_PREFIX = "listings:v1:"
+# Bumped on every listing write; it is part of each browse key, so a write makes
+# all cached browse results unreachable at once (old entries just expire)
+LISTINGS_GENERATION_KEY = "listings:v1:gen"
+CACHE_TTL_SECONDS = 300
+
+app = FastAPI(
+    title="RAKB API",
+    description="Rental Agency platform for cars and renters in Morocco",
+    default_response_class=MongoJSONResponse,
+)
+
+# Listing payloads are repetitive JSON; small responses are left uncompressed.
+# Added before CORS so CORS stays outermost: preflights are answered without
+# passing through gzip, and CORS headers go on the already-compressed response.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Explicit allowlists let the middleware answer preflights with fixed headers,
+# and max_age lets browsers cache the preflight for a day
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
+if not CORS_ORIGINS:
+    logger.warning("CORS_ORIGINS is not set; browser clients on other origins will be blocked")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    max_age=86400,
 )
 
 
-@app.get("/")
-def read_root():
-    return {"name": "RAKB API", "status": "ok"}
+@app.on_event("startup")
+async def start_database_setup():
+    # Runs in the background so an unreachable MongoDB cannot fail or stall boot;
+    # /test keeps reporting the database state meanwhile.
+    app.state.setup_task = asyncio.create_task(ensure_indexes())
+
+
+async def ensure_indexes():
+    """Create the indexes backing browse and booking queries (idempotent) and run backfills"""
+    if db is None:
+        return
+    try:
+        await db["listing"].create_index([("city", 1), ("daily_price", 1)], collation=CITY_COLLATION)
+        await db["booking_slots"].create_index([("listing_id", 1)], unique=True)
+        await db["city"].create_index([("name", 1)], unique=True, collation=CITY_COLLATION)
+        await run_once("city_backfill_v1", sync_cities)
+        await run_once(BOOKING_SLOTS_BACKFILL, sync_booking_slots)
+    except Exception:
+        logger.exception("Database index/backfill setup failed")
+
+
+async def run_once(name: str, job):
+    """Run an idempotent backfill job until it has completed once.
+
+    Completion is recorded in a marker document only after the job succeeds, so a
+    crash, cancellation or error simply lets the next boot run it again. Workers
+    booting together may each run it; the jobs are safe to repeat.
+    """
+    if await db["migrations"].find_one({"_id": name, "completed_at": {"$exists": True}}):
+        return
+    await job()
+    await db["migrations"].update_one(
+        {"_id": name},
+        {"$set": {"completed_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def sync_cities():
+    """Backfill the city collection from the distinct cities of existing listings"""
+    pipeline = [
+        {"$match": {"city": {"$type": "string"}}},
+        {"$group": {"_id": "$city"}},
+        {"$project": {"_id": 0, "name": "$_id"}},
+        {"$merge": {"into": "city", "on": "name", "whenMatched": "keepExisting", "whenNotMatched": "insert"}},
+    ]
+    await db["listing"].aggregate(pipeline, collation=CITY_COLLATION).to_list(length=None)
+
+
+BOOKING_SLOTS_BACKFILL = "booking_slots_backfill_v1"
+
+
+async def booking_slots_ready() -> bool:
+    """Whether booking_slots has been backfilled from existing bookings (cached once true)"""
+    if getattr(app.state, "booking_slots_ready", False):
+        return True
+    done = await db["migrations"].find_one(
+        {"_id": BOOKING_SLOTS_BACKFILL, "completed_at": {"$exists": True}}, {"_id": 1}
+    )
+    if done:
+        app.state.booking_slots_ready = True
+    return done is not None
+
+
+def _iso_date(field: str) -> dict:
+    """Aggregation expression rendering a stored date (BSON date or ISO string) as YYYY-MM-DD"""
+    return {"$cond": [
+        {"$eq": [{"$type": field}, "date"]},
+        {"$dateToString": {"format": "%Y-%m-%d", "date": field}},
+        field,
+    ]}
+
+
+async def sync_booking_slots():
+    """Backfill booking_slots from existing bookings so their dates stay reserved"""
+    pipeline = [
+        {"$match": {"listing_id": {"$type": "string"}}},
+        {"$group": {
+            "_id": "$listing_id",
+            "slots": {"$addToSet": {"start": _iso_date("$start_date"), "end": _iso_date("$end_date")}},
+        }},
+        {"$project": {"_id": 0, "listing_id": "$_id", "slots": 1}},
+        # union with slots reserved meanwhile instead of overwriting them
+        {"$merge": {
+            "into": "booking_slots",
+            "on": "listing_id",
+            "whenMatched": [{"$set": {"slots": {"$setUnion": ["$slots", "$$new.slots"]}}}],
+            "whenNotMatched": "insert",
+        }},
+    ]
+    await db["booking"].aggregate(pipeline).to_list(length=None)
+
+
+def is_object_id(value) -> bool:
+    """Cheap check for a 24-char hex string, so bad ids are rejected without a bson parse"""
+    return isinstance(value, str) and len(value) == 24 and _HEX_DIGITS.issuperset(value)
+
+
+async def cache_get(key: str) -> Optional[bytes]:
+    """Return the cached payload for key, or None on a miss or when Redis is unavailable"""
+    if cache is None:
+        return None
+    try:
+        return await cache.get(key)
+    except Exception:
+        return None
+
+
+async def cache_set(key: str, payload: bytes) -> None:
+    """Store a serialized payload under key; cache failures never fail the request"""
+    if cache is None:
+        return
+    try:
+        await cache.set(key, payload, ex=CACHE_TTL_SECONDS)
+    except Exception:
+        pass
+
+
+async def bump_listings_generation() -> None:
+    """Invalidate every cached browse result after a listing write"""
+    if cache is None:
+        return
+    try:
+        await cache.incr(LISTINGS_GENERATION_KEY)
+    except Exception:
+        pass
+
+
+async def cache_delete(key: str) -> None:
+    """Drop a cached payload so the next read rebuilds it"""
+    if cache is None:
+        return
+    try:
+        await cache.delete(key)
+    except Exception:
+        pass
+
+
+@app.get("/", response_model=None)
+async def read_root():
+    return MongoJSONResponse(content={"name": "RAKB API", "status": "ok"})
 
 
 # ---------- Public browse/search ----------
 class ListingQuery(BaseModel):
-    city: Optional[str] = None
-    min_price: Optional[float] = None
-    max_price: Optional[float] = None
-    limit: int = 24
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+
+    city: Optional[str] = Field(None, max_length=64, pattern=r"^[\w\s\-']+$")
+    min_price: Optional[float] = Field(None, ge=0)
+    max_price: Optional[float] = Field(None, ge=0)
+    limit: int = Field(24, ge=1, le=100)
+
+    @field_validator("city", mode="before")
+    @classmethod
+    def blank_city_means_any(cls, value):
+        # UIs send "" for "all cities"; treat blank as no filter before the pattern check
+        if isinstance(value, str) and not value.strip():
+            return None
+        return value
+
+
+async def listings_cache_key(query: ListingQuery) -> Optional[str]:
+    """Cache key for a browse query under the current listings generation, or None to skip caching"""
+    if cache is None:
+        return None
+    try:
+        generation = await cache.get(LISTINGS_GENERATION_KEY)
+    except Exception:
+        # without the generation a stale entry could be served; bypass the cache
+        return None
+    digest = hashlib.sha1(orjson.dumps(
+        [query.city.lower() if query.city else None, query.min_price, query.max_price, query.limit]
+    )).hexdigest()
+    return f"{LISTINGS_CACHE_PREFIX}{int(generation or 0)}:{digest}"
 
 
-@app.post("/api/listings")
-def list_listings(query: ListingQuery):
+@app.post("/api/listings", response_model=None)
+async def list_listings(query: ListingQuery):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
 
+    cache_key = await listings_cache_key(query)
+    if cache_key is not None:
+        cached = await cache_get(cache_key)
+        if cached:
+            return Response(content=cached, media_type="application/json")
+
     filt: dict = {}
     if query.city:
-        # case-insensitive exact match for city
-        filt["city"] = {"$regex": f"^{query.city}$", "$options": "i"}
+        # case-insensitive exact match for city, resolved by CITY_COLLATION on the index
+        filt["city"] = query.city
 
     price_filter = {}
     if query.min_price is not None:
@@ -51,108 +273,219 @@ def list_listings(query: ListingQuery):
     if price_filter:
         filt["daily_price"] = price_filter
 
-    docs = get_documents("listing", filt, limit=query.limit)
-
-    # Shape results: ensure consistent id string
-    items = []
-    for d in docs:
-        d = dict(d)
-        d["id"] = str(d.pop("_id", ""))
-        # try to enrich with car basic fields if available
-        try:
-            if d.get("car_id"):
-                car = db["car"].find_one({"_id": ObjectId(d["car_id"])})
-                if car:
-                    car["id"] = str(car.pop("_id", ""))
-                    d["car"] = car
-        except Exception:
-            pass
-        items.append(d)
-
-    return {"items": items}
+    # Join each listing with its car server-side: one round-trip instead of 1 + N.
+    # Only the fields a listing card needs are projected (full docs are served by
+    # the detail endpoint) and ids are stringified by MongoDB itself.
+    pipeline = [
+        {"$match": filt},
+        {"$limit": query.limit},
+        {"$project": {
+            "_id": 0,
+            "id": {"$toString": "$_id"},
+            "city": 1,
+            "daily_price": 1,
+            "car_id": 1,
+            "description": 1,
+        }},
+        {"$lookup": {
+            "from": "car",
+            "let": {"cid": {"$convert": {"input": "$car_id", "to": "objectId", "onError": None}}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$cid"]}}},
+                {"$project": {
+                    "_id": 0,
+                    "id": {"$toString": "$_id"},
+                    "make": 1,
+                    "model": 1,
+                    "year": 1,
+                    "thumb": {"$arrayElemAt": ["$photos", 0]},
+                }},
+            ],
+            "as": "car",
+        }},
+        {"$unwind": {"path": "$car", "preserveNullAndEmptyArrays": True}},
+    ]
+
+    # limit is capped at 100, so the whole result fits in the aggregate's first
+    # batch; fetching it before responding lets Mongo errors surface as a 500
+    cursor = db["listing"].aggregate(pipeline, collation=CITY_COLLATION)
+    items = await cursor.to_list(length=query.limit)
+    response = MongoJSONResponse(content={"items": items})
+    if cache_key is not None:
+        await cache_set(cache_key, response.body)
+    return response
 
 
-@app.get("/api/listings/{listing_id}")
-def get_listing_detail(listing_id: str):
+@app.get("/api/listings/{listing_id}", response_model=None)
+async def get_listing_detail(listing_id: str):
     """Fetch a single listing by id, including its car details."""
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    try:
-        lst = db["listing"].find_one({"_id": ObjectId(listing_id)})
-        if not lst:
-            raise HTTPException(status_code=404, detail="Listing not found")
-        lst = dict(lst)
-        lst["id"] = str(lst.pop("_id", ""))
-        # attach car
-        car_doc = None
-        try:
-            if lst.get("car_id"):
-                car_doc = db["car"].find_one({"_id": ObjectId(lst["car_id"])})
-        except Exception:
-            car_doc = None
+    if not is_object_id(listing_id):
+        raise HTTPException(status_code=400, detail="Invalid id format")
+    lst = await db["listing"].find_one({"_id": ObjectId(listing_id)})
+    if not lst:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    lst = dict(lst)
+    lst["id"] = str(lst.pop("_id", ""))
+    # attach car; a malformed car_id just leaves the car off
+    car_id = lst.get("car_id")
+    if is_object_id(car_id):
+        car_doc = await db["car"].find_one({"_id": ObjectId(car_id)})
         if car_doc:
             car_doc = dict(car_doc)
             car_doc["id"] = str(car_doc.pop("_id", ""))
             lst["car"] = car_doc
-        return lst
-    except HTTPException:
-        raise
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid id format")
+    return MongoJSONResponse(content=lst)
 
 
-@app.get("/api/cities")
-def get_cities():
+@app.get("/api/cities", response_model=None)
+async def get_cities():
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    cities = db["listing"].distinct("city")
-    cities = sorted([c for c in cities if isinstance(c, str)])
-    return {"items": cities}
+    cached = await cache_get(CITIES_CACHE_KEY)
+    if cached:
+        return Response(content=cached, media_type="application/json")
+    # served from the small, uniquely indexed city collection instead of a distinct() over listings
+    cursor = db["city"].find({}, {"_id": 0, "name": 1}, collation=CITY_COLLATION).sort("name", 1)
+    cities = [c["name"] async for c in cursor]
+    response = MongoJSONResponse(content={"items": cities})
+    await cache_set(CITIES_CACHE_KEY, response.body)
+    return response
 
 
 # ---------- Minimal creation endpoints (for seeding/demo) ----------
-@app.post("/api/users", status_code=201)
-def create_user(user: User):
-    user_id = create_document("user", user)
-    return {"id": user_id}
-
+@app.post("/api/users", status_code=201, response_model=None)
+async def create_user(user: User):
+    user_id = await create_document("user", user)
+    return MongoJSONResponse(content={"id": user_id}, status_code=201)
+
+
+@app.post("/api/cars", status_code=201, response_model=None)
+async def create_car(car: Car):
+    car_id = await create_document("car", car)
+    return MongoJSONResponse(content={"id": car_id}, status_code=201)
+
+
+@app.post("/api/listing", status_code=201, response_model=None)
+async def create_listing(listing: Listing):
+    listing_id = await create_document("listing", listing)
+    # a new listing may introduce a city
+    await db["city"].update_one(
+        {"name": listing.city},
+        {"$setOnInsert": {"name": listing.city}},
+        upsert=True,
+        collation=CITY_COLLATION,
+    )
+    await cache_delete(CITIES_CACHE_KEY)
+    await bump_listings_generation()
+    return MongoJSONResponse(content={"id": listing_id}, status_code=201)
+
+
+# Upper bound on documents per bulk request
+BULK_MAX_ITEMS = 500
+
+
+def bulk_result(ids: List[Optional[str]]) -> MongoJSONResponse:
+    """Report inserted ids plus the input positions that failed to insert"""
+    return MongoJSONResponse(
+        content={
+            "ids": [i for i in ids if i is not None],
+            "failed": [n for n, i in enumerate(ids) if i is None],
+        },
+        status_code=201,
+    )
+
+
+@app.post("/api/users/bulk", status_code=201, response_model=None)
+async def create_users_bulk(users: List[User] = Body(..., max_length=BULK_MAX_ITEMS)):
+    user_ids = await create_documents("user", users) if users else []
+    return bulk_result(user_ids)
+
+
+@app.post("/api/cars/bulk", status_code=201, response_model=None)
+async def create_cars_bulk(cars: List[Car] = Body(..., max_length=BULK_MAX_ITEMS)):
+    car_ids = await create_documents("car", cars) if cars else []
+    return bulk_result(car_ids)
+
+
+@app.post("/api/listings/bulk", status_code=201, response_model=None)
+async def create_listings_bulk(listings: List[Listing] = Body(..., max_length=BULK_MAX_ITEMS)):
+    if not listings:
+        return bulk_result([])
+    listing_ids = await create_documents("listing", listings)
+    # only cities of listings that were actually written
+    cities = {listing.city for listing, i in zip(listings, listing_ids) if i is not None}
+    if cities:
+        await db["city"].bulk_write(
+            [
+                UpdateOne({"name": c}, {"$setOnInsert": {"name": c}}, upsert=True, collation=CITY_COLLATION)
+                for c in cities
+            ],
+            ordered=False,
+        )
+        await cache_delete(CITIES_CACHE_KEY)
+        await bump_listings_generation()
+    return bulk_result(listing_ids)
+
+
+@app.post("/api/bookings", status_code=201, response_model=None)
+async def create_booking(booking: Booking):
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
 
-@app.post("/api/cars", status_code=201)
-def create_car(car: Car):
-    car_id = create_document("car", car)
-    return {"id": car_id}
+    # Reserve the range atomically on the listing's slots document: the push only
+    # matches when no existing slot overlaps. If one does, the upsert collides with
+    # the unique listing_id index instead, so concurrent bookings cannot both win.
+    slot = {"start": booking.start_date.isoformat(), "end": booking.end_date.isoformat()}
+
+    if not await booking_slots_ready():
+        # Until the backfill completes, older bookings are missing from booking_slots;
+        # check them directly (stored as ISO strings or as BSON datetimes).
+        start_dt = datetime.combine(booking.start_date, time.min)
+        end_dt = datetime.combine(booking.end_date, time.min)
+        overlap = await db["booking"].find_one({
+            "listing_id": booking.listing_id,
+            "$or": [
+                {"start_date": {"$lte": slot["end"]}, "end_date": {"$gte": slot["start"]}},
+                {"start_date": {"$lte": end_dt}, "end_date": {"$gte": start_dt}},
+            ],
+        }, {"_id": 1})
+        if overlap:
+            raise HTTPException(status_code=400, detail="Dates not available")
+
+    for attempt in range(2):
+        try:
+            await db["booking_slots"].update_one(
+                {
+                    "listing_id": booking.listing_id,
+                    "slots": {"$not": {"$elemMatch": {"start": {"$lte": slot["end"]}, "end": {"$gte": slot["start"]}}}},
+                },
+                {"$push": {"slots": slot}},
+                upsert=True,
+            )
+            break
+        except DuplicateKeyError:
+            # Either the dates overlap, or a concurrent first booking created the
+            # document between our match and upsert; a retry now matches it.
+            if attempt:
+                raise HTTPException(status_code=400, detail="Dates not available")
 
+    try:
+        # dates are stored as ISO strings, matching the slots (BSON has no date-only type)
+        booking_id = await create_document("booking", booking.model_dump(mode="json"))
+    except Exception:
+        # release the reserved range so a failed insert does not block the dates
+        await db["booking_slots"].update_one({"listing_id": booking.listing_id}, {"$pull": {"slots": slot}})
+        raise
+    return MongoJSONResponse(content={"id": booking_id}, status_code=201)
 
-@app.post("/api/listing", status_code=201)
-def create_listing(listing: Listing):
-    listing_id = create_document("listing", listing)
-    return {"id": listing_id}
 
+HEALTH_REFRESH_SECONDS = 30
 
-@app.post("/api/bookings", status_code=201)
-def create_booking(booking: Booking):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
 
-    # Basic overlap check using ISO date strings or date objects
-    overlap = db["booking"].find_one({
-        "listing_id": booking.listing_id,
-        "$or": [
-            {
-                "start_date": {"$lte": booking.end_date},
-                "end_date": {"$gte": booking.start_date},
-            }
-        ],
-    })
-    if overlap:
-        raise HTTPException(status_code=400, detail="Dates not available")
-
-    booking_id = create_document("booking", booking)
-    return {"id": booking_id}
-
-
-@app.get("/test")
-def test_database():
+async def check_database() -> dict:
+    """Build the /test status payload; involves a MongoDB round-trip"""
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -169,7 +502,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -185,7 +518,48 @@ def test_database():
     return response
 
 
+async def refresh_health_loop():
+    """Recompute the cached /test payload every HEALTH_REFRESH_SECONDS"""
+    while True:
+        try:
+            # render first, then swap the reference, so readers never see a partial payload
+            app.state.health = dump_json(await check_database())
+        except Exception:
+            logger.exception("Health check refresh failed")
+        await asyncio.sleep(HEALTH_REFRESH_SECONDS)
+
+
+@app.on_event("startup")
+async def start_health_refresh():
+    # the first check runs in the background too; until it lands /test computes on demand
+    app.state.health = None
+    app.state.health_task = asyncio.create_task(refresh_health_loop())
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for name in ("health_task", "setup_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    await close_connections()
+
+
+@app.get("/test", response_model=None)
+async def test_database():
+    # probes hit this often; serve the payload refreshed in the background
+    health = getattr(app.state, "health", None)
+    if health is None:
+        health = dump_json(await check_database())
+    return Response(content=health, media_type="application/json")
+
+
 if __name__ == "__main__":
+    # single-process dev server; production runs under gunicorn (see gunicorn_conf.py)
     import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
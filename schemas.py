@@ -57,7 +57,7 @@ class Booking(BaseModel):
     A renter's reservation for a listing
     Collection: "booking"
     """
-    listing_id: str = Field(..., description="Listing reference")
+    listing_id: str = Field(..., pattern=r"^[0-9a-fA-F]{24}$", description="Listing reference")
     renter_id: str = Field(..., description="Renter user id")
     start_date: date = Field(..., description="Start date")
     end_date: date = Field(..., description="End date")
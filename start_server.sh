@@ -12,8 +12,10 @@ if [ ! -z "$PIDS" ]; then
 fi
 
 mkdir -p logs
+# browser origin of the local frontend dev server; override for other setups
+export CORS_ORIGINS="${CORS_ORIGINS:-http://localhost:3000}"
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools --reload > logs/server.log 2>&1 
 echo "Server started in background"